@@ -1,8 +1,10 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import datetime
 import sseclient
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # List of chat-capable Bedrock models (same as test1.py)
 CHAT_MODELS = [
@@ -33,6 +35,28 @@ CHAT_MODELS = [
     "us.meta.llama3-3-70b-instruct-v1:0"
 ]
 
+def parse_nova_chunk(response_chunk):
+    """
+    Parse the inner JSON payload of a Nova-shaped chunk exactly once
+    Returns: dict or None if the payload is not valid JSON
+    """
+    raw = response_chunk['chunk'].get('bytes', b'')
+    if isinstance(raw, bytes):
+        raw = raw.decode()
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+
+def verify_nova_chunk(chunk_data):
+    """
+    Verify an already-parsed Nova chunk payload
+    Returns: (bool, str) - (is_valid, error_message)
+    """
+    if chunk_data and chunk_data.get('contentBlockDelta', {}).get('delta', {}).get('text'):
+        return True, "Response chunk valid"
+    return False, f"Missing or invalid content in chunk: {str(chunk_data)}"
+
 def verify_stream_response(response_chunk):
     """
     Verify if a streaming response chunk is valid
@@ -50,13 +74,9 @@ def verify_stream_response(response_chunk):
 
         # Handle Nova model responses
         if 'chunk' in response_chunk:
-            chunk_content = response_chunk['chunk'].get('bytes', b'').decode()
-            try:
-                chunk_data = json.loads(chunk_content)
-                if chunk_data.get('contentBlockDelta', {}).get('delta', {}).get('text'):
-                    return True, "Response chunk valid"
-            except json.JSONDecodeError:
-                pass
+            is_valid, validation_message = verify_nova_chunk(parse_nova_chunk(response_chunk))
+            if is_valid:
+                return is_valid, validation_message
 
         # Handle content field directly
         if 'content' in response_chunk:
@@ -83,7 +103,115 @@ def verify_stream_response(response_chunk):
     except Exception as e:
         return False, f"Verification error: {str(e)}\nChunk: {str(response_chunk)}"
 
-def test_bedrock_streaming(token, prompt, max_retries=1, retry_delay=5):
+def build_payload_template(prompt):
+    """
+    Build the model-independent part of the chat request payload once
+    """
+    return {
+        "conversation_history": [
+            {
+                "role": "user",
+                "content": prompt,
+                "type": "text"
+            }
+        ],
+        "model": None,
+        "stream": True,
+        "temperature": 0.7,
+        "max_tokens": 4096,
+        "modelParams": {
+            "modelId": None,
+            "temperature": 0.7,
+            "maxTokens": 4096,
+            "topP": 0.9
+        }
+    }
+
+def run_model_streaming(session, url, headers, model, payload_template, max_retries=1, retry_delay=5):
+    """
+    Run the streaming test for a single model
+    Returns: (dict, str) - (result, failure_reason or None)
+    """
+    # Models run concurrently, so only the two model fields are copied per model;
+    # the conversation history is shared from the template
+    payload = dict(payload_template, model=model)
+    payload['modelParams'] = dict(payload_template['modelParams'], modelId=model)
+
+    result = None
+    failure = None
+    retry_count = 0
+    while retry_count < max_retries:
+        try:
+            print(f"[{model}] Attempt {retry_count + 1}/{max_retries}...")
+            response = session.post(url, headers=headers, json=payload, stream=True)
+
+            if response.status_code == 200:
+                client = sseclient.SSEClient(response)
+                full_response = ""
+                chunks_received = 0
+                valid_stream = True
+
+                for event in client.events():
+                    if event.data:
+                        try:
+                            chunk_data = json.loads(event.data)
+                            is_valid, validation_message = verify_stream_response(chunk_data)
+
+                            if is_valid:
+                                chunks_received += 1
+                                # Nova text sits in a second JSON document inside the chunk
+                                nova_data = parse_nova_chunk(chunk_data) if 'chunk' in chunk_data else None
+                                if verify_nova_chunk(nova_data)[0]:
+                                    full_response += nova_data['contentBlockDelta']['delta']['text']
+                                elif 'delta' in chunk_data:
+                                    full_response += chunk_data['delta']
+                            else:
+                                valid_stream = False
+                                print(f"[{model}] ⚠️ Invalid chunk: {validation_message}")
+                                break
+                        except json.JSONDecodeError:
+                            valid_stream = False
+                            print(f"[{model}] ⚠️ Invalid JSON in chunk")
+                            break
+
+                if valid_stream and chunks_received > 0:
+                    print(f"[{model}] ✅ Success! Received {chunks_received} valid chunks")
+                    return {
+                        'status': 'success',
+                        'chunks_received': chunks_received,
+                        'full_response': full_response
+                    }, None
+                result = {
+                    'status': 'stream_error',
+                    'error': 'Invalid or empty stream'
+                }
+                failure = "Stream validation failed"
+
+            else:
+                print(f"[{model}] ❌ Error: Status code {response.status_code}")
+                result = {
+                    'status': 'error',
+                    'error': f'Status code: {response.status_code}',
+                    'message': response.text
+                }
+                failure = f"HTTP Error {response.status_code}"
+
+        except Exception as e:
+            print(f"[{model}] ❌ Exception: {str(e)}")
+            result = {
+                'status': 'error',
+                'error': str(e)
+            }
+            failure = f"Exception: {str(e)}"
+
+        if retry_count < max_retries - 1:
+            print(f"[{model}] Retrying in {retry_delay} seconds...")
+            time.sleep(retry_delay)
+        retry_count += 1
+
+    return result, failure
+
+def test_bedrock_streaming(token, prompt, max_retries=1, retry_delay=5, max_workers=8):
     url = 'http://localhost:8000/chat'
     headers = {
         'Authorization': f'Bearer {token}',
@@ -94,115 +222,39 @@ def test_bedrock_streaming(token, prompt, max_retries=1, retry_delay=5):
     successful_models = []
     failed_models = []
 
-    for model in CHAT_MODELS:
-        print(f"\n{'='*50}")
-        print(f"Testing streaming for model: {model}")
-        print(f"{'='*50}")
-
-        payload = {
-            "conversation_history": [
-                {
-                    "role": "user",
-                    "content": prompt,
-                    "type": "text"
-                }
-            ],
-            "model": model,
-            "stream": True,
-            "temperature": 0.7,
-            "max_tokens": 4096,
-            "modelParams": {
-                "modelId": model,
-                "temperature": 0.7,
-                "maxTokens": 4096,
-                "topP": 0.9
-            }
+    payload_template = build_payload_template(prompt)
+
+    # One pooled session reuses TCP connections across models instead of
+    # reconnecting per request
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(16, max_workers), max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    # Each model test is a long-lived, I/O-bound stream, so run them concurrently;
+    # max_workers caps the number of in-flight streams in case the server throttles
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(run_model_streaming, session, url, headers, model, payload_template,
+                            max_retries, retry_delay): model
+            for model in CHAT_MODELS
         }
+        for future in as_completed(futures):
+            model = futures[future]
+            results[model], failure = future.result()
+            if failure is None:
+                successful_models.append(model)
+            else:
+                failed_models.append((model, failure))
 
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                print(f"Attempt {retry_count + 1}/{max_retries}...")
-                response = requests.post(url, headers=headers, json=payload, stream=True)
-                
-                if response.status_code == 200:
-                    client = sseclient.SSEClient(response)
-                    full_response = ""
-                    chunks_received = 0
-                    valid_stream = True
-
-                    print("Receiving stream:")
-                    for event in client.events():
-                        if event.data:
-                            try:
-                                chunk_data = json.loads(event.data)
-                                is_valid, validation_message = verify_stream_response(chunk_data)
-                                
-                                if is_valid:
-                                    chunks_received += 1
-                                    if 'delta' in chunk_data:
-                                        full_response += chunk_data['delta']
-                                        print(chunk_data['delta'], end='', flush=True)
-                                else:
-                                    valid_stream = False
-                                    print(f"\n⚠️ Invalid chunk: {validation_message}")
-                                    break
-                            except json.JSONDecodeError:
-                                valid_stream = False
-                                print(f"\n⚠️ Invalid JSON in chunk")
-                                break
+            # Print detailed results
+            print(f"\nStream test results for {model}:")
+            print(json.dumps(results[model], indent=2))
 
-                    print("\n")
-                    if valid_stream and chunks_received > 0:
-                        results[model] = {
-                            'status': 'success',
-                            'chunks_received': chunks_received,
-                            'full_response': full_response
-                        }
-                        successful_models.append(model)
-                        print(f"✅ Success! Received {chunks_received} valid chunks")
-                        break
-                    else:
-                        if retry_count == max_retries - 1:
-                            results[model] = {
-                                'status': 'stream_error',
-                                'error': 'Invalid or empty stream'
-                            }
-                            failed_models.append((model, "Stream validation failed"))
-                
-                else:
-                    print(f"❌ Error: Status code {response.status_code}")
-                    if retry_count == max_retries - 1:
-                        results[model] = {
-                            'status': 'error',
-                            'error': f'Status code: {response.status_code}',
-                            'message': response.text
-                        }
-                        failed_models.append((model, f"HTTP Error {response.status_code}"))
-
-            except Exception as e:
-                print(f"❌ Exception: {str(e)}")
-                if retry_count == max_retries - 1:
-                    results[model] = {
-                        'status': 'error',
-                        'error': str(e)
-                    }
-                    failed_models.append((model, f"Exception: {str(e)}"))
-
-            if retry_count < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            retry_count += 1
-
-        # Print detailed results
-        print("\nStream test results:")
-        print(json.dumps(results[model], indent=2))
-
-        # Ask user if they want to continue to next model
-        # if model != CHAT_MODELS[-1]:
-        #     continue_test = input("\nContinue to next model? (y/n): ").lower()
-        #     if continue_test != 'y':
-        #         break
+    # Keep the report in CHAT_MODELS order regardless of completion order
+    order = {model: i for i, model in enumerate(CHAT_MODELS)}
+    successful_models.sort(key=order.get)
+    failed_models.sort(key=lambda item: order[item[0]])
 
     return results, successful_models, failed_models
 
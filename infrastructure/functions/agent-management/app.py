@@ -1,11 +1,19 @@
 import json
 import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
 import os
+import logging
 import traceback
 from typing import Dict, List, Any, Optional
 from decimal import Decimal
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Initialize logging; set LOG_LEVEL=DEBUG to see per-request access decisions
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
 # Initialize clients
 dynamodb = boto3.resource('dynamodb')
@@ -19,11 +27,68 @@ USER_POOL_ID = os.environ['USER_POOL_ID']
 IDENTITY_POOL_ID = os.environ.get('IDENTITY_POOL_ID')
 ALLOWED_ORIGINS = os.environ.get('ALLOWED_ORIGINS', '*')
 
+# Response headers are identical for every request
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': ALLOWED_ORIGINS,
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Requested-With',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,DELETE,PUT'
+}
+
 # Initialize tables
 agents_table = dynamodb.Table(AGENTS_TABLE_NAME)
 shared_agents_table = dynamodb.Table(SHARED_AGENTS_TABLE_NAME)
 user_groups_table = dynamodb.Table(USER_GROUPS_TABLE_NAME)
 
+# Shared across warm invocations to overlap independent DynamoDB calls. Table resources
+# are not thread-safe, so work submitted here uses the low-level client, which is, and
+# deserializes its items to the types the resources return
+executor = ThreadPoolExecutor(max_workers=16)
+dynamodb_client = dynamodb.meta.client
+deserializer = TypeDeserializer()
+
+# Short-lived cache of user -> group IDs, shared across warm invocations
+USER_GROUPS_CACHE_TTL_SECONDS = 30
+USER_GROUPS_CACHE_MAX_SIZE = 1024
+user_groups_cache = {}
+
+# Agents table indexes
+PUBLIC_AGENTS_INDEX = 'PublicAgentsIndex'
+SHARED_AGENT_SHARED_BY_INDEX = 'AgentSharedByIndex'
+
+# Attributes returned by GET /agents?view=summary; leaves out large fields such as
+# systemPrompt. Every name is aliased since several are DynamoDB reserved words.
+AGENT_SUMMARY_ATTRIBUTES = [
+    'userId', 'id', 'name', 'description', 'type', 'version',
+    'createdAt', 'lastEditedAt', 'visibility', 'knowledgeBaseId'
+]
+AGENT_SUMMARY_PROJECTION = {
+    'ProjectionExpression': ', '.join(f'#{name}' for name in AGENT_SUMMARY_ATTRIBUTES),
+    'ExpressionAttributeNames': {f'#{name}': name for name in AGENT_SUMMARY_ATTRIBUTES}
+}
+
+# Results of check_agent_access
+ACCESS_OWNER = 'owner'
+ACCESS_SHARED = 'shared'
+ACCESS_PUBLIC = 'public'
+ACCESS_DENIED = 'denied'
+ACCESS_NOT_FOUND = 'not_found'
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_MAX_KEYS = 100
+BATCH_MAX_RETRIES = 5
+
+# Agent attributes a PUT may change; type, createdAt and the Bedrock ids are never updated
+AGENT_UPDATABLE_ATTRIBUTES = ['name', 'description', 'systemPrompt', 'modelParams', 'knowledgeBaseId', 'telegramToken']
+
+# DynamoDB error codes that are answered with a specific status instead of a 500
+CLIENT_ERROR_RESPONSES = {
+    'ConditionalCheckFailedException': (409, "CONFLICT"),
+    'ValidationException': (400, "VALIDATION_ERROR"),
+    'ProvisionedThroughputExceededException': (429, "THROTTLED"),
+    'ThrottlingException': (429, "THROTTLED"),
+    'RequestLimitExceeded': (429, "THROTTLED"),
+}
+
 # Helper class for DynamoDB Decimal conversion
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -31,6 +96,10 @@ class DecimalEncoder(json.JSONEncoder):
             return float(obj)
         return super(DecimalEncoder, self).default(obj)
 
+# Shared encoder for response bodies; default() is only called for Decimal
+# leaves, the rest of the body is encoded by the C encoder
+response_encoder = DecimalEncoder()
+
 def convert_floats_to_decimals(obj):
     """Recursively converts all float values to Decimal for DynamoDB compatibility"""
     if isinstance(obj, float):
@@ -46,12 +115,8 @@ def create_response(status_code: int, body: dict) -> dict:
     """Create a standardized API response"""
     return {
         "statusCode": status_code,
-        "body": json.dumps(body, cls=DecimalEncoder),
-        "headers": {
-            'Access-Control-Allow-Origin': ALLOWED_ORIGINS,
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Requested-With',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,DELETE,PUT'
-        }
+        "body": response_encoder.encode(body),
+        "headers": CORS_HEADERS
     }
 
 def create_error_response(status_code: int, error_code: str, error_message: str) -> dict:
@@ -64,6 +129,20 @@ def create_error_response(status_code: int, error_code: str, error_message: str)
         }
     })
 
+def create_client_error_response(e: ClientError) -> dict:
+    """Create an error response for an AWS ClientError, logging it without a stack trace"""
+    error_code = e.response['Error']['Code']
+    error_message = e.response['Error']['Message']
+    logger.warning(json.dumps({
+        'event': 'aws_error',
+        'operation': e.operation_name,
+        'code': error_code,
+        'message': error_message
+    }))
+    
+    status_code, response_code = CLIENT_ERROR_RESPONSES.get(error_code, (500, "AWS_ERROR"))
+    return create_error_response(status_code, response_code, f"{error_code}: {error_message}")
+
 def get_user_info(event) -> dict:
     """Extract user information from Cognito authorizer context"""
     request_context = event.get('requestContext', {})
@@ -93,64 +172,196 @@ def get_user_info(event) -> dict:
         'groups': groups
     }
 
-def check_agent_access(agent_id: str, user_id: str) -> bool:
+def query_all(table, **kwargs) -> List[dict]:
+    """Run a query and follow LastEvaluatedKey until every page has been read"""
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def deserialize_item(item: dict) -> dict:
+    """Convert a low-level client item to plain Python values (numbers become Decimal)"""
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+def query_partition(table_name: str, key_name: str, key_value: str, **kwargs) -> List[dict]:
+    """
+    Read every item whose partition key equals key_value, following LastEvaluatedKey
+    
+    Uses the low-level client, so it is safe to run on executor threads. kwargs may
+    add IndexName, ProjectionExpression and ExpressionAttributeNames.
+    """
+    kwargs['TableName'] = table_name
+    kwargs['KeyConditionExpression'] = '#partitionKey = :partitionKey'
+    kwargs['ExpressionAttributeNames'] = {**kwargs.get('ExpressionAttributeNames', {}), '#partitionKey': key_name}
+    kwargs['ExpressionAttributeValues'] = {':partitionKey': {'S': key_value}}
+    
+    items = []
+    while True:
+        response = dynamodb_client.query(**kwargs)
+        items.extend(deserialize_item(item) for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def batch_get_agents(keys: List[dict], projection: Optional[dict] = None) -> Dict[tuple, dict]:
+    """
+    Fetch agents by their {'userId', 'id'} keys using BatchGetItem
+    
+    projection optionally holds ProjectionExpression/ExpressionAttributeNames
+    to apply to every request.
+    
+    Keys are de-duplicated and requested in chunks of 100; UnprocessedKeys
+    are retried with exponential backoff.
+    
+    Returns:
+        dict: Agent items keyed by (userId, id)
+    """
+    unique_keys = list({(key['userId'], key['id']): key for key in keys}.values())
+    agents = {}
+    
+    for start in range(0, len(unique_keys), BATCH_GET_MAX_KEYS):
+        request_items = {
+            AGENTS_TABLE_NAME: {'Keys': unique_keys[start:start + BATCH_GET_MAX_KEYS], **(projection or {})}
+        }
+        retries = 0
+        
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(AGENTS_TABLE_NAME, []):
+                agents[(item['userId'], item['id'])] = item
+            
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items:
+                if retries >= BATCH_MAX_RETRIES:
+                    raise Exception("Failed to fetch all shared agents: too many unprocessed keys")
+                time.sleep(0.05 * (2 ** retries))
+                retries += 1
+    
+    return agents
+
+def get_user_group_ids(user_id: str) -> List[str]:
+    """
+    Get the IDs of the groups a user belongs to
+    
+    Results are cached for USER_GROUPS_CACHE_TTL_SECONDS, so membership
+    changes made elsewhere become visible within that window.
+    """
+    now = time.time()
+    cached = user_groups_cache.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+    
+    # Runs on executor threads too, so it goes through the client
+    user_groups = query_partition(USER_GROUPS_TABLE_NAME, 'userId', user_id)
+    group_ids = [item['groupId'] for item in user_groups]
+    
+    # Evict the oldest entry when full (dicts keep insertion order)
+    user_groups_cache.pop(user_id, None)
+    if len(user_groups_cache) >= USER_GROUPS_CACHE_MAX_SIZE:
+        user_groups_cache.pop(next(iter(user_groups_cache)), None)
+    user_groups_cache[user_id] = (group_ids, now + USER_GROUPS_CACHE_TTL_SECONDS)
+    
+    return group_ids
+
+def get_shared_agent_records(group_ids: List[str], agent_id: str) -> List[tuple]:
+    """
+    Look up the share record of an agent in each group concurrently
+    
+    Returns:
+        list: (group_id, shared_agent) pairs, in group_ids order, for the
+        groups the agent is shared with
+    """
+    futures = [
+        (group_id, executor.submit(
+            dynamodb_client.get_item,
+            TableName=SHARED_AGENTS_TABLE_NAME,
+            Key={
+                'groupId': {'S': group_id},
+                'agentId': {'S': agent_id}
+            }
+        ))
+        for group_id in group_ids
+    ]
+    
+    records = []
+    for group_id, future in futures:
+        shared_agent_response = future.result()
+        if 'Item' in shared_agent_response:
+            records.append((group_id, deserialize_item(shared_agent_response['Item'])))
+    
+    return records
+
+def check_agent_access(agent_id: str, user_id: str) -> tuple:
     """
-    Check if user has access to the agent
+    Resolve how a user can access an agent
     - User is the owner
     - Agent is shared with a group user belongs to
     - Agent is public
+    
+    Returns:
+        tuple: (access, detail) where access is one of the ACCESS_* values and
+        detail is the owned agent item (ACCESS_OWNER), the list of
+        (group_id, shared_agent) records (ACCESS_SHARED), the owner's user ID
+        (ACCESS_PUBLIC) or None
     """
-    try:
-        # Check if user is the owner
-        response = agents_table.get_item(
-            Key={
-                'userId': user_id,
-                'id': agent_id
-            }
-        )
-        if 'Item' in response:
+    # Check if user is the owner
+    response = agents_table.get_item(
+        Key={
+            'userId': user_id,
+            'id': agent_id
+        }
+    )
+    if 'Item' in response:
+        return ACCESS_OWNER, response['Item']
+    
+    # Check if the agent is shared with any groups user belongs to
+    user_group_ids = get_user_group_ids(user_id)
+    if user_group_ids:
+        shared_records = get_shared_agent_records(user_group_ids, agent_id)
+        if shared_records:
+            return ACCESS_SHARED, shared_records
+    
+    # Check if the agent is public
+    public_response = agents_table.query(
+        IndexName=PUBLIC_AGENTS_INDEX,
+        KeyConditionExpression=(
+            boto3.dynamodb.conditions.Key('visibility').eq('public') &
+            boto3.dynamodb.conditions.Key('id').eq(agent_id)
+        ),
+        ProjectionExpression='userId',
+        Limit=1
+    )
+    if public_response.get('Items'):
+        logger.debug("Agent %s is public, granting access", agent_id)
+        return ACCESS_PUBLIC, public_response['Items'][0]['userId']
+    
+    # No access; check if the agent exists at all to tell a 403 from a 404
+    if agent_exists(agent_id):
+        return ACCESS_DENIED, None
+    return ACCESS_NOT_FOUND, None
+
+def agent_exists(agent_id: str) -> bool:
+    """
+    Check whether an agent with this ID exists under any owner
+    
+    The agents table has no index on id alone yet, so this scans, following pages
+    until a match; a Limit on a filtered scan only bounds the items read per page.
+    It only runs for requests that are denied anyway.
+    """
+    scan_kwargs = {
+        'FilterExpression': boto3.dynamodb.conditions.Attr('id').eq(agent_id),
+        'ProjectionExpression': 'id'
+    }
+    while True:
+        response = agents_table.scan(**scan_kwargs)
+        if response.get('Items'):
             return True
-        
-        # Check if the agent is public
-        # First, get the agent data from any user
-        # Scan is not ideal for production, consider creating a GSI on agent ID
-        scan_response = agents_table.scan(
-            FilterExpression=boto3.dynamodb.conditions.Attr('id').eq(agent_id),
-            ProjectionExpression="id, userId, visibility",
-            Limit=1  # Limit to just one match
-        )
-        
-        for item in scan_response.get('Items', []):
-            if item.get('visibility') == 'public':
-                print(f"Agent {agent_id} is public, granting access")
-                return True
-            
-        # Check if the agent is shared with any groups user belongs to
-        user_groups_response = user_groups_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('userId').eq(user_id)
-        )
-        
-        if not user_groups_response.get('Items'):
+        if 'LastEvaluatedKey' not in response:
             return False
-            
-        user_group_ids = [item['groupId'] for item in user_groups_response['Items']]
-        
-        # Check if agent is shared with any of these groups
-        for group_id in user_group_ids:
-            shared_agent_response = shared_agents_table.get_item(
-                Key={
-                    'groupId': group_id,
-                    'agentId': agent_id
-                }
-            )
-            if 'Item' in shared_agent_response:
-                return True
-                
-        return False
-        
-    except Exception as e:
-        print(f"Error checking agent access: {str(e)}")
-        return False
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
 def list_agents(user_id: str, query_params: dict) -> dict:
     """
@@ -158,75 +369,84 @@ def list_agents(user_id: str, query_params: dict) -> dict:
     
     Parameters:
         user_id (str): User ID
-        query_params (dict): Query parameters for filtering
+        query_params (dict): Query parameters for filtering; view=summary
+            returns only AGENT_SUMMARY_ATTRIBUTES for each agent
     
     Returns:
         dict: Response with agents list
     """
     try:
-        # Get agents owned by the user
-        owned_agents_response = agents_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('userId').eq(user_id)
+        projection = AGENT_SUMMARY_PROJECTION if query_params.get('view') == 'summary' else {}
+        
+        # Owned agents, group memberships and public agents are independent,
+        # so fetch them concurrently
+        owned_future = executor.submit(
+            query_partition, AGENTS_TABLE_NAME, 'userId', user_id, **projection
+        )
+        user_groups_future = executor.submit(get_user_group_ids, user_id)
+        public_future = executor.submit(
+            query_partition, AGENTS_TABLE_NAME, 'visibility', 'public',
+            IndexName=PUBLIC_AGENTS_INDEX, **projection
         )
         
-        owned_agents = owned_agents_response.get('Items', [])
+        # Get agents owned by the user
+        owned_agents = owned_future.result()
         
         # Format owned agents
         for agent in owned_agents:
             agent['isOwner'] = True
         
         # Get groups the user belongs to
-        user_groups_response = user_groups_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('userId').eq(user_id)
-        )
+        user_group_ids = user_groups_future.result()
         
         shared_agents = []
-        
-        # For each group, get shared agents
-        if user_groups_response.get('Items'):
-            for group_membership in user_groups_response['Items']:
-                group_id = group_membership['groupId']
+        shared_records = []
+        
+        # IDs already in the response, so each agent is listed once
+        seen_ids = {agent['id'] for agent in owned_agents}
+        
+        # For each group, get shared agent references (one query per group, in parallel)
+        shared_futures = [
+            (group_id, executor.submit(query_partition, SHARED_AGENTS_TABLE_NAME, 'groupId', group_id))
+            for group_id in user_group_ids
+        ]
+        
+        for group_id, future in shared_futures:
+            for shared_agent in future.result():
+                shared_records.append((group_id, shared_agent))
+        
+        # Get the actual agent data for all shared references in batched reads
+        if shared_records:
+            agents_by_key = batch_get_agents([
+                {'userId': shared_agent['sharedBy'], 'id': shared_agent['agentId']}
+                for _, shared_agent in shared_records
+            ], projection)
+            
+            for group_id, shared_agent in shared_records:
+                agent_data = agents_by_key.get((shared_agent['sharedBy'], shared_agent['agentId']))
                 
-                shared_agents_response = shared_agents_table.query(
-                    KeyConditionExpression=boto3.dynamodb.conditions.Key('groupId').eq(group_id)
-                )
+                # Skip missing agents and duplicates (an agent shared via several groups)
+                if agent_data is None or agent_data['id'] in seen_ids:
+                    continue
+                
+                agent_data['isOwner'] = False
+                agent_data['sharedBy'] = shared_agent['sharedBy']
+                agent_data['sharedVia'] = group_id
+                agent_data['permissions'] = shared_agent.get('permissions', 'read')
                 
-                if shared_agents_response.get('Items'):
-                    for shared_agent in shared_agents_response['Items']:
-                        # Get the actual agent data
-                        agent_response = agents_table.get_item(
-                            Key={
-                                'userId': shared_agent['sharedBy'],
-                                'id': shared_agent['agentId']
-                            }
-                        )
-                        
-                        if 'Item' in agent_response:
-                            agent_data = agent_response['Item']
-                            agent_data['isOwner'] = False
-                            agent_data['sharedBy'] = shared_agent['sharedBy']
-                            agent_data['sharedVia'] = group_id
-                            agent_data['permissions'] = shared_agent.get('permissions', 'read')
-                            
-                            # Avoid duplicates
-                            if not any(a['id'] == agent_data['id'] for a in shared_agents):
-                                shared_agents.append(agent_data)
+                shared_agents.append(agent_data)
+                seen_ids.add(agent_data['id'])
         
         # Get public agents that the user doesn't already own
         public_agents = []
         
-        # This scan is not ideal for production, consider creating a GSI on visibility
-        public_scan_response = agents_table.scan(
-            FilterExpression=boto3.dynamodb.conditions.Attr('visibility').eq('public')
-        )
-        
-        for agent in public_scan_response.get('Items', []):
+        for agent in public_future.result():
             # Skip if user already owns this agent
             if agent.get('userId') == user_id:
                 continue
                 
-            # Skip if this agent is already in shared_agents
-            if any(a['id'] == agent['id'] for a in shared_agents):
+            # Skip if this agent is already listed as shared
+            if agent['id'] in seen_ids:
                 continue
                 
             agent['isOwner'] = False
@@ -250,6 +470,8 @@ def list_agents(user_id: str, query_params: dict) -> dict:
             "data": all_agents
         })
         
+    except ClientError as e:
+        return create_client_error_response(e)
     except Exception as e:
         traceback.print_exc()
         return create_error_response(500, "INTERNAL_ERROR", str(e))
@@ -266,81 +488,76 @@ def get_agent(agent_id: str, user_id: str) -> dict:
         dict: Response with agent details
     """
     try:
-        # Try to get agent as owned by the user first
-        response = agents_table.get_item(
-            Key={
-                'userId': user_id,
-                'id': agent_id
-            }
-        )
+        access, detail = check_agent_access(agent_id, user_id)
         
-        if 'Item' in response:
-            agent = response['Item']
+        if access == ACCESS_OWNER:
+            agent = detail
             agent['isOwner'] = True
             return create_response(200, {
                 "success": True,
                 "data": agent
             })
         
-        # If not owned, check if the user has access to this agent
-        has_access = check_agent_access(agent_id, user_id)
+        if access == ACCESS_NOT_FOUND:
+            return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
+        
+        if access == ACCESS_DENIED:
+            return create_error_response(403, "ACCESS_DENIED", "You don't have access to this agent")
         
-        if not has_access:
-            # Check if agent exists at all to return proper error code
-            scan_response = agents_table.scan(
-                FilterExpression=boto3.dynamodb.conditions.Attr('id').eq(agent_id),
-                ProjectionExpression="id",
-                Limit=1
+        if access == ACCESS_PUBLIC:
+            agent_response = agents_table.get_item(
+                Key={
+                    'userId': detail,
+                    'id': agent_id
+                }
             )
             
-            if not scan_response.get('Items'):
+            if 'Item' not in agent_response:
                 return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
-            else:
-                return create_error_response(403, "ACCESS_DENIED", "You don't have access to this agent")
-        
-        # If not owned, find which group it's shared through
-        user_groups_response = user_groups_table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('userId').eq(user_id)
-        )
-        
-        if not user_groups_response.get('Items'):
-            return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
-        
-        for group_membership in user_groups_response['Items']:
-            group_id = group_membership['groupId']
             
-            shared_agent_response = shared_agents_table.get_item(
+            agent = agent_response['Item']
+            agent['isOwner'] = False
+            agent['isPublic'] = True
+            agent['accessType'] = 'public'
+            agent['permissions'] = {
+                'canView': True,
+                'canEdit': False,
+                'canDelete': False,
+                'canShare': False,
+                'canExecute': True
+            }
+            
+            return create_response(200, {
+                "success": True,
+                "data": agent
+            })
+        
+        # Shared with one of the user's groups
+        for group_id, shared_agent in detail:
+            # Get actual agent data
+            agent_response = agents_table.get_item(
                 Key={
-                    'groupId': group_id,
-                    'agentId': agent_id
+                    'userId': shared_agent['sharedBy'],
+                    'id': agent_id
                 }
             )
             
-            if 'Item' in shared_agent_response:
-                shared_agent = shared_agent_response['Item']
-                
-                # Get actual agent data
-                agent_response = agents_table.get_item(
-                    Key={
-                        'userId': shared_agent['sharedBy'],
-                        'id': agent_id
-                    }
-                )
+            if 'Item' in agent_response:
+                agent = agent_response['Item']
+                agent['isOwner'] = False
+                agent['sharedBy'] = shared_agent['sharedBy']
+                agent['sharedVia'] = group_id
+                agent['permissions'] = shared_agent.get('permissions', 'read')
                 
-                if 'Item' in agent_response:
-                    agent = agent_response['Item']
-                    agent['isOwner'] = False
-                    agent['sharedBy'] = shared_agent['sharedBy']
-                    agent['sharedVia'] = group_id
-                    agent['permissions'] = shared_agent.get('permissions', 'read')
-                    
-                    return create_response(200, {
-                        "success": True,
-                        "data": agent
-                    })
+                return create_response(200, {
+                    "success": True,
+                    "data": agent
+                })
         
         return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
         
+    except ClientError as e:
+        return create_client_error_response(e)
     except Exception as e:
         traceback.print_exc()
         return create_error_response(500, "INTERNAL_ERROR", str(e))
@@ -369,10 +586,6 @@ def create_agent(body: dict, user_id: str) -> dict:
         
         # Convert any float values in modelParams to Decimal
         model_params = convert_floats_to_decimals(body['modelParams'])
-        if isinstance(model_params, dict):
-            for key, value in model_params.items():
-                if isinstance(value, float):
-                    model_params[key] = Decimal(str(value))
         
         agent = {
             'userId': user_id,
@@ -401,14 +614,26 @@ def create_agent(body: dict, user_id: str) -> dict:
         if body.get('type') == 'bedrock' and 'bedrockAgentAliasId' in body:
             agent['bedrockAgentAliasId'] = body['bedrockAgentAliasId']
         
-        # Save to DynamoDB
-        agents_table.put_item(Item=agent)
+        # Save to DynamoDB without overwriting an agent the user already has
+        try:
+            agents_table.put_item(
+                Item=agent,
+                ConditionExpression='attribute_not_exists(id)'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                # The key includes userId, so the existing agent is the caller's own; clients
+                # working from a stale list POST agents they already own, so save it as an update
+                return update_agent(agent_id, body, user_id)
+            raise
         
         return create_response(201, {
             "success": True,
             "data": agent
         })
         
+    except ClientError as e:
+        return create_client_error_response(e)
     except Exception as e:
         traceback.print_exc()
         return create_error_response(500, "INTERNAL_ERROR", str(e))
@@ -426,114 +651,72 @@ def update_agent(agent_id: str, body: dict, user_id: str) -> dict:
         dict: Response with updated agent details
     """
     try:
-        # First check if the user owns the agent
-        response = agents_table.get_item(
-            Key={
-                'userId': user_id,
-                'id': agent_id
-            }
-        )
+        access, detail = check_agent_access(agent_id, user_id)
         
-        is_owner = 'Item' in response
-        existing_agent = None
+        is_owner = access == ACCESS_OWNER
         original_owner_id = None
         
+        if access == ACCESS_NOT_FOUND:
+            return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
+        
         if is_owner:
-            existing_agent = response['Item']
+            owner_id = user_id
         else:
             # If not the owner, check if they have access through a group with write permissions
-            user_groups_response = user_groups_table.query(
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('userId').eq(user_id)
-            )
+            if access == ACCESS_SHARED:
+                for group_id, shared_agent in detail:
+                    if shared_agent.get('permissions') == 'write':
+                        original_owner_id = shared_agent['sharedBy']
+                        break
             
-            has_write_permission = False
+            if not original_owner_id:
+                return create_error_response(403, "PERMISSION_DENIED", f"You don't have permission to update agent {agent_id}")
             
-            if user_groups_response.get('Items'):
-                for group_membership in user_groups_response['Items']:
-                    group_id = group_membership['groupId']
-                    
-                    shared_agent_response = shared_agents_table.get_item(
-                        Key={
-                            'groupId': group_id,
-                            'agentId': agent_id
-                        }
-                    )
-                    
-                    if 'Item' in shared_agent_response:
-                        shared_agent = shared_agent_response['Item']
-                        if shared_agent.get('permissions') == 'write':
-                            has_write_permission = True
-                            original_owner_id = shared_agent['sharedBy']
-                            break
-            
-            if has_write_permission and original_owner_id:
-                # Get the actual agent from the original owner
-                agent_response = agents_table.get_item(
-                    Key={
-                        'userId': original_owner_id,
-                        'id': agent_id
-                    }
-                )
-                
-                if 'Item' in agent_response:
-                    existing_agent = agent_response['Item']
-                else:
-                    return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
-            else:
-                # Check if agent exists at all to return proper error code
-                scan_response = agents_table.scan(
-                    FilterExpression=boto3.dynamodb.conditions.Attr('id').eq(agent_id),
-                    ProjectionExpression="id",
-                    Limit=1
-                )
-                
-                if not scan_response.get('Items'):
-                    return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
-                else:
-                    return create_error_response(403, "PERMISSION_DENIED", f"You don't have permission to update agent {agent_id}")
-        
-        # Convert any float values in modelParams to Decimal if provided
-        model_params = convert_floats_to_decimals(body.get('modelParams', existing_agent['modelParams']))
-
-        if isinstance(model_params, dict):
-            for key, value in model_params.items():
-                if isinstance(value, float):
-                    model_params[key] = Decimal(str(value))
-        
-        # Update fields
-        updated_agent = {
-            'userId': existing_agent['userId'],  # Preserve original owner
-            'id': agent_id,
-            'name': body.get('name', existing_agent['name']),
-            'description': body.get('description', existing_agent.get('description', '')),
-            'systemPrompt': body.get('systemPrompt', existing_agent['systemPrompt']),
-            'modelParams': model_params,  # Use the converted parameters
-            'version': existing_agent.get('version', 0) + 1,
-            'createdAt': existing_agent['createdAt'],
-            'lastEditedAt': int(time.time() * 1000),
-            'type': existing_agent.get('type', 'custom')  # Preserve the original type
+            owner_id = original_owner_id
+        
+        # Only the attributes sent in the body are set; the rest of the stored
+        # agent is left as is, so no read of the full item is needed
+        expression_names = {'#version': 'version', '#lastEditedAt': 'lastEditedAt'}
+        expression_values = {
+            ':zero': 0,
+            ':one': 1,
+            ':now': int(time.time() * 1000)
         }
+        set_clauses = [
+            '#version = if_not_exists(#version, :zero) + :one',
+            '#lastEditedAt = :now'
+        ]
         
-        # Optional fields
-        if 'knowledgeBaseId' in body:
-            updated_agent['knowledgeBaseId'] = body['knowledgeBaseId']
-        elif 'knowledgeBaseId' in existing_agent:
-            updated_agent['knowledgeBaseId'] = existing_agent['knowledgeBaseId']
-            
-        if 'telegramToken' in body:
-            updated_agent['telegramToken'] = body['telegramToken']
-        elif 'telegramToken' in existing_agent:
-            updated_agent['telegramToken'] = existing_agent['telegramToken']
-        
-        # Bedrock specific fields - don't allow updating these
-        if existing_agent.get('type') == 'bedrock':
-            if 'bedrockAgentId' in existing_agent:
-                updated_agent['bedrockAgentId'] = existing_agent['bedrockAgentId']
-            if 'bedrockAgentAliasId' in existing_agent:
-                updated_agent['bedrockAgentAliasId'] = existing_agent['bedrockAgentAliasId']
+        for attribute in AGENT_UPDATABLE_ATTRIBUTES:
+            if attribute not in body:
+                continue
+            value = body[attribute]
+            if attribute == 'modelParams':
+                # Convert any float values in modelParams to Decimal
+                value = convert_floats_to_decimals(value)
+            expression_names[f'#{attribute}'] = attribute
+            expression_values[f':{attribute}'] = value
+            set_clauses.append(f'#{attribute} = :{attribute}')
+        
+        # Update in DynamoDB; the condition turns a concurrently deleted agent into a 404
+        try:
+            update_response = agents_table.update_item(
+                Key={
+                    'userId': owner_id,
+                    'id': agent_id
+                },
+                UpdateExpression='SET ' + ', '.join(set_clauses),
+                ConditionExpression='attribute_exists(id)',
+                ExpressionAttributeNames=expression_names,
+                ExpressionAttributeValues=expression_values,
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return create_error_response(404, "AGENT_NOT_FOUND", f"Agent {agent_id} not found")
+            raise
         
-        # Save to DynamoDB
-        agents_table.put_item(Item=updated_agent)
+        updated_agent = update_response['Attributes']
         
         # Add shared information for the response if user is not the owner
         if not is_owner:
@@ -547,6 +730,8 @@ def update_agent(agent_id: str, body: dict, user_id: str) -> dict:
             "data": updated_agent
         })
         
+    except ClientError as e:
+        return create_client_error_response(e)
     except Exception as e:
         traceback.print_exc()
         return create_error_response(500, "INTERNAL_ERROR", str(e))
@@ -583,30 +768,31 @@ def delete_agent(agent_id: str, user_id: str) -> dict:
         )
         
         # Delete all shared references to this agent
-        # Note: This could be moved to a separate cleanup function or Lambda
-        # if there are many shares or for better performance
-        
-        # Scan shared_agents_table for this agent ID
-        # Note: In production with large tables, consider using a GSI instead
-        shared_items = shared_agents_table.scan(
-            FilterExpression=boto3.dynamodb.conditions.Attr('agentId').eq(agent_id) & 
-                            boto3.dynamodb.conditions.Attr('sharedBy').eq(user_id)
+        shared_items = query_all(
+            shared_agents_table,
+            IndexName=SHARED_AGENT_SHARED_BY_INDEX,
+            KeyConditionExpression=boto3.dynamodb.conditions.Key('agentId').eq(agent_id) &
+                                   boto3.dynamodb.conditions.Key('sharedBy').eq(user_id)
         )
         
-        # Delete each shared reference
-        for item in shared_items.get('Items', []):
-            shared_agents_table.delete_item(
-                Key={
-                    'groupId': item['groupId'],
-                    'agentId': agent_id
-                }
-            )
+        # batch_writer sends the deletes in BatchWriteItem calls of up to 25
+        # and resubmits unprocessed items
+        with shared_agents_table.batch_writer() as batch:
+            for item in shared_items:
+                batch.delete_item(
+                    Key={
+                        'groupId': item['groupId'],
+                        'agentId': agent_id
+                    }
+                )
         
         return create_response(200, {
             "success": True,
             "message": f"Agent {agent_id} deleted successfully"
         })
         
+    except ClientError as e:
+        return create_client_error_response(e)
     except Exception as e:
         traceback.print_exc()
         return create_error_response(500, "INTERNAL_ERROR", str(e))
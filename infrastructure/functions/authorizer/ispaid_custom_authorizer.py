@@ -1,26 +1,66 @@
 # custom_authorizer.py
+#
+# Thread safety: Lambda runs one invocation at a time per process, but the module
+# state below is kept safe for concurrent handler calls anyway. Reads go through
+# single dict operations (atomic in CPython), cache writes take a lock, and a JWKS
+# refresh swaps in the new keys with one update.
 import json
 import time
 import os
+import logging
+import hashlib
+import base64
 import jwt
-from jwt.algorithms import RSAAlgorithm
-import urllib.request
+import urllib3
 import re
+import threading
 
-# Cache for the public keys
-jwks_cache = {}
-jwks_url = None  # Will be populated at initialization
+# Initialize logging; set LOG_LEVEL=DEBUG to include tracebacks for rejected tokens
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+# Get your user pool ID from environment variables
+user_pool_id = os.environ['USER_POOL_ID']
+region = os.environ['AWS_REGION']
+issuer = f'https://cognito-idp.{region}.amazonaws.com/{user_pool_id}'
+jwks_url = f'{issuer}/.well-known/jwks.json'
+
+# How long fetched keys are trusted before the JWKS is fetched again
+JWKS_TTL_SECONDS = 3600
+# Minimum interval between JWKS fetch attempts after a failure or for an unknown kid
+JWKS_RETRY_SECONDS = 60
+
+# Connection pool reused across invocations, so JWKS refreshes skip the TCP/TLS handshake.
+# No retries: a failed fetch is retried after JWKS_RETRY_SECONDS instead, so a fetch for an
+# unknown kid, the only one in the request path, waits at most connect + read timeout
+http = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=2,
+    timeout=urllib3.Timeout(connect=1.0, read=2.0),
+    retries=False
+)
+
+# Cache for the public keys, parsed once per fetch and keyed by kid
+jwks_cache = {'keys': {}, 'fetched_at': 0}
+# Time of the last fetch started from the request path, successful or not
+last_fetch_attempt = 0
+# Held while deciding on a refresh (and doing it for an unknown kid), so concurrent callers fetch once
+jwks_lock = threading.Lock()
+
+# Claims (and their JSON encoding) of recently validated tokens, keyed by the token's
+# SHA-256 digest; entries never outlive the token's exp. Only successful validations are cached
+TOKEN_CACHE_TTL_SECONDS = 300
+TOKEN_CACHE_MAX_SIZE = 1024
+token_cache = {}
+token_cache_lock = threading.Lock()
+
+# Policy documents keyed by (effect, resource ARN)
+policy_documents = {}
+
+# methodArn format: arn:aws:execute-api:{regionId}:{accountId}:{apiId}/{stage}/{httpVerb}/[{resource}/{childResource}]
+METHOD_ARN_PATTERN = re.compile(r'^arn:aws:execute-api:([^:]+):([^:]+):([^/]+)/([^/]+)/')
 
 def lambda_handler(event, context):
-    global jwks_url
-    
-    # If not yet initialized
-    if jwks_url is None:
-        # Get your user pool ID from environment variables
-        user_pool_id = os.environ['USER_POOL_ID']
-        region = os.environ['AWS_REGION']
-        jwks_url = f'https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/jwks.json'
-    
     # Get the token from the Authorization header
     token = event['authorizationToken']
     if token.startswith('Bearer '):
@@ -28,7 +68,10 @@ def lambda_handler(event, context):
     
     try:
         # Validate the token
-        claims = validate_token(token)
+        claims, claims_json = get_token_claims(token)
+        
+        # The policy covers the whole API stage, so only that part of the methodArn is needed
+        api_arn = get_api_arn(event['methodArn'])
         
         # Get the user's Cognito groups
         cognito_groups = claims.get('cognito:groups', [])
@@ -40,20 +83,45 @@ def lambda_handler(event, context):
         
         if is_paid:
             # Generate policy allowing access
-            policy = generate_policy(claims['sub'], 'Allow', event['methodArn'], claims, cognito_groups)
+            policy = generate_policy(claims['sub'], 'Allow', api_arn, claims, claims_json, cognito_groups)
             return policy
         else:
             # Deny access if not in required groups
-            policy = generate_policy(claims['sub'], 'Deny', event['methodArn'], claims, cognito_groups)
+            policy = generate_policy(claims['sub'], 'Deny', api_arn, claims, claims_json, cognito_groups)
             return policy
             
     except Exception as e:
-        print(f"Token validation error: {str(e)}")
+        # Only the message is logged by default; formatting a traceback for every
+        # rejected token is wasted work when bad tokens arrive in bulk
+        logger.warning("Token validation error: %s", e)
+        logger.debug("Token validation traceback", exc_info=True)
         raise Exception('Unauthorized')
 
+def get_token_claims(token):
+    # Reuse the claims of a token validated recently instead of verifying the signature again
+    now = time.time()
+    key = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(key)
+    if cached and cached[2] > now:
+        return cached[0], cached[1]
+    
+    claims = validate_token(token)
+    # Encoded once here for the policy context, which only accepts string values
+    claims_json = json.dumps(claims)
+    
+    # Evict the oldest entry when full (dicts keep insertion order)
+    with token_cache_lock:
+        token_cache.pop(key, None)
+        if len(token_cache) >= TOKEN_CACHE_MAX_SIZE:
+            token_cache.pop(next(iter(token_cache)), None)
+        token_cache[key] = (claims, claims_json, min(claims['exp'], now + TOKEN_CACHE_TTL_SECONDS))
+    
+    return claims, claims_json
+
 def validate_token(token):
-    # Decode the token header
-    header = jwt.get_unverified_header(token)
+    # Decode the token header; jwt.decode checks it again during verification
+    header_segment = token.split('.', 1)[0]
+    header = json.loads(base64.urlsafe_b64decode(header_segment + '=' * (-len(header_segment) % 4)))
     
     # Get the key ID from the header
     kid = header['kid']
@@ -62,66 +130,97 @@ def validate_token(token):
     public_key = get_public_key(kid)
     
     # Verify the token
-    user_pool_id = os.environ['USER_POOL_ID']
-    region = os.environ['AWS_REGION']
-    
     claims = jwt.decode(
         token,
         public_key,
         algorithms=['RS256'],
-        options={"verify_aud": False},
-        issuer=f'https://cognito-idp.{region}.amazonaws.com/{user_pool_id}'
+        options={"verify_aud": False, "require": ["exp"]},
+        issuer=issuer
     )
     
-    # Check token expiration
-    if time.time() > claims['exp']:
-        raise Exception('Token has expired')
-    
     return claims
 
-def get_public_key(kid):
-    global jwks_cache, jwks_url
+def fetch_jwks():
+    response = http.request('GET', jwks_url)
+    if response.status != 200:
+        raise Exception(f'JWKS fetch failed with status {response.status}')
+    jwks = json.loads(response.data)
     
-    # If the key is not in the cache or cache is empty, fetch from JWKS URL
-    if not jwks_cache or kid not in jwks_cache:
-        response = urllib.request.urlopen(jwks_url)
-        jwks = json.loads(response.read())
-        
-        # Update the cache with all keys
-        jwks_cache = {key['kid']: key for key in jwks['keys']}
+    # Update the cache with all keys; PyJWK builds the RSA key object up front
+    # so requests don't re-parse the JWK. A single update() swaps keys and timestamp together
+    keys = {key['kid']: jwt.PyJWK(key) for key in jwks['keys']}
+    jwks_cache.update(keys=keys, fetched_at=time.time())
+
+def refresh_jwks():
+    # Runs on a background thread; on failure the stale keys stay in use until the next attempt
+    try:
+        fetch_jwks()
+    except Exception as e:
+        logger.warning("JWKS refresh failed, keeping cached keys: %s", e)
+
+def get_public_key(kid):
+    global last_fetch_attempt
     
-    if kid not in jwks_cache:
-        raise Exception(f'Public key {kid} not found')
+    keys = jwks_cache['keys']
+    if kid in keys:
+        now = time.time()
+        if now - jwks_cache['fetched_at'] > JWKS_TTL_SECONDS and now - last_fetch_attempt > JWKS_RETRY_SECONDS:
+            # Re-checked under the lock so only one caller starts the refresh
+            with jwks_lock:
+                if now - last_fetch_attempt > JWKS_RETRY_SECONDS:
+                    last_fetch_attempt = now
+                    # The stale key keeps verifying tokens while the keys are refreshed in the
+                    # background, so a slow or unavailable JWKS endpoint never delays a request
+                    threading.Thread(target=refresh_jwks, daemon=True).start()
+        return keys[kid].key
     
-    # Get the key from the cache
-    jwk = jwks_cache[kid]
+    # Unknown kid: the keys were never fetched or have been rotated. Fetch now, but at
+    # most once per interval so tokens with bogus kids can't force a fetch on every request
+    with jwks_lock:
+        now = time.time()
+        if kid not in jwks_cache['keys'] and now - last_fetch_attempt > JWKS_RETRY_SECONDS:
+            last_fetch_attempt = now
+            fetch_jwks()
     
-    # Convert the JWK to a PEM format
-    public_key = RSAAlgorithm.from_jwk(json.dumps(jwk))
-    return public_key
-
-def generate_policy(principal_id, effect, resource, claims, groups):
-    # Extract the API ID, stage, and base resource path from the methodArn
-    # methodArn format: arn:aws:execute-api:{regionId}:{accountId}:{apiId}/{stage}/{httpVerb}/[{resource}/{childResource}]
-    tmp = resource.split(':')
-    api_gateway_arn = tmp[5].split('/')
-    aws_account_id = tmp[4]
-    region = tmp[3]
-    api_id = api_gateway_arn[0]
-    stage = api_gateway_arn[1]
+    keys = jwks_cache['keys']
+    if kid not in keys:
+        raise Exception(f'Public key {kid} not found')
     
-    # Create a policy that allows access to all methods and paths
-    policy = {
-        'principalId': principal_id,
-        'policyDocument': {
+    # Get the parsed key from the cache
+    return keys[kid].key
+
+def get_policy_document(effect, resource_arn):
+    # Policy documents only vary by effect and API/stage, so each one is built once
+    # per container and reused; API Gateway never mutates the returned policy
+    key = (effect, resource_arn)
+    policy_document = policy_documents.get(key)
+    if policy_document is None:
+        policy_document = {
             'Version': '2012-10-17',
             'Statement': [{
                 'Action': 'execute-api:Invoke',
                 'Effect': effect,
-                # Allow access to all methods and paths in this API and stage
-                'Resource': f'arn:aws:execute-api:{region}:{aws_account_id}:{api_id}/{stage}/*'
+                'Resource': resource_arn
             }]
-        },
+        }
+        policy_documents[key] = policy_document
+    return policy_document
+
+def get_api_arn(method_arn):
+    # Extract the region, account, API ID and stage from the methodArn
+    match = METHOD_ARN_PATTERN.match(method_arn)
+    if match is None:
+        raise Exception(f'Unexpected methodArn: {method_arn}')
+    region, aws_account_id, api_id, stage = match.groups()
+    
+    # ARN covering all methods and paths in this API and stage
+    return f'arn:aws:execute-api:{region}:{aws_account_id}:{api_id}/{stage}/*'
+
+def generate_policy(principal_id, effect, api_arn, claims, claims_json, groups):
+    # Create a policy that covers all methods and paths in this API and stage
+    policy = {
+        'principalId': principal_id,
+        'policyDocument': get_policy_document(effect, api_arn),
         'context': {
             'sub': claims['sub'],
             'username': claims.get('cognito:username', ''),
@@ -129,8 +228,15 @@ def generate_policy(principal_id, effect, resource, claims, groups):
             'isAdmin': str('admin' in groups).lower(),
             'isPaid': str('paid' in groups).lower(),
             'groups': ','.join(groups),
-            'claims': json.dumps(claims)
+            'claims': claims_json
         }
     }
     
-    return policy
\ No newline at end of file
+    return policy
+
+# Fetch the keys during Lambda initialization so the first request finds them warm;
+# on failure the handler falls back to fetching lazily
+try:
+    fetch_jwks()
+except Exception as e:
+    logger.warning("JWKS prefetch failed: %s", e)
@@ -1,10 +1,15 @@
 import json
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 import os
+import re
 import traceback
 import time
 import uuid
-from typing import Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 # Environment variables
@@ -13,16 +18,81 @@ ATTACHMENTS_BUCKET = os.environ['ATTACHMENTS_BUCKET']
 BDA_BUCKET = os.environ['BDA_BUCKET']
 BEDROCK_KB_ROLE_ARN = os.environ['BEDROCK_KB_ROLE_ARN']
 BDA_RESULTS_QUEUE_URL = os.environ.get('BDA_RESULTS_QUEUE_URL', '')
+BDA_JOB_QUEUE_URL = os.environ.get('BDA_JOB_QUEUE_URL', '')
 SYNC_SESSIONS_TABLE = os.environ.get('SYNC_SESSIONS_TABLE', '')
+AWS_ACCOUNT_ID = os.environ.get('AWS_ACCOUNT_ID', '')
+BDA_PROJECT_ARN = os.environ.get('BDA_PROJECT_ARN', '')
+
+# Upper bound on records processed at the same time within one invocation
+MAX_CONCURRENT_RECORDS = 10
+
+# Connections each client keeps pooled for the concurrent records
+MAX_POOL_CONNECTIONS = 50
+
+# Shared client config: a larger connection pool for concurrent record processing,
+# TCP keep-alive so pooled connections survive the idle gaps while BDA jobs run,
+# and adaptive retries to back off when S3 or BDA throttle
+CLIENT_CONFIG = boto3.session.Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 5}
+)
+
+# Managed copies switch to parallel UploadPartCopy parts for large files, which also
+# lifts the 5 GB single CopyObject limit. Part threads share the S3 client's pool with
+# the other records, so each copy gets an even share of it
+COPY_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=max(1, MAX_POOL_CONNECTIONS // MAX_CONCURRENT_RECORDS),
+    use_threads=True
+)
 
 # Initialize clients
-s3 = boto3.client('s3', config=boto3.session.Config(signature_version='s3v4'))
-sqs = boto3.client('sqs')
-dynamodb = boto3.resource('dynamodb')
-bedrock_agent = boto3.client('bedrock-agent', region_name=REGION_NAME)
-bda_runtime_client = boto3.client('bedrock-data-automation-runtime', region_name='us-east-1')
+s3 = boto3.client('s3', config=CLIENT_CONFIG.merge(boto3.session.Config(signature_version='s3v4')))
+sqs = boto3.client('sqs', config=CLIENT_CONFIG)
+dynamodb = boto3.resource('dynamodb', config=CLIENT_CONFIG)
+bedrock_agent = boto3.client('bedrock-agent', region_name=REGION_NAME, config=CLIENT_CONFIG)
+bda_runtime_client = boto3.client('bedrock-data-automation-runtime', region_name='us-east-1', config=CLIENT_CONFIG)
+bda_client = boto3.client('bedrock-data-automation', region_name='us-east-1', config=CLIENT_CONFIG)
+sts_client = boto3.client('sts', config=CLIENT_CONFIG)
+
+# BDA project used for image processing, created on first use if missing
+BDA_PROJECT_NAME = "image_processing_bda_project"
+BDA_STANDARD_OUTPUT_CONFIG = {
+    "image": {
+        "extraction": {
+            "category": {
+                "state": "ENABLED",
+                "types": ["CONTENT_MODERATION", "TEXT_DETECTION"]
+            },
+            "boundingBox": {"state": "ENABLED"}
+        },
+        "generativeField": {
+            "state": "ENABLED",
+            "types": ["IMAGE_SUMMARY", "IAB"]
+        }
+    }
+}
+
+# Looked up once per container unless configured; neither changes while the function is deployed
+account_id = AWS_ACCOUNT_ID or None
+bda_project_arn = BDA_PROJECT_ARN or None
+# Records run on worker threads; only one of them may look up or create the project
+bda_project_lock = threading.Lock()
+
+# Image types always sent to BDA; PDFs only when they look scanned
+BDA_IMAGE_EXTENSIONS = frozenset({'jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp'})
 
-# DynamoDB table
+# Markers of text content in a PDF; a file showing fewer than two distinct markers
+# near its start is treated as scanned
+PDF_TEXT_MARKER_PATTERN = re.compile(rb'/Font|/Text|BT|ET')
+
+# Stop polling a BDA job when less than this much invocation time would be left after
+# the next sleep; the wait then continues from a delayed message on the job queue
+POLL_DEADLINE_MARGIN_MS = 15000
+
+# DynamoDB table; only used on the handler thread, since resources are not thread-safe
 if SYNC_SESSIONS_TABLE:
     sync_sessions_table = dynamodb.Table(SYNC_SESSIONS_TABLE)
 
@@ -34,25 +104,61 @@ def lambda_handler(event, context):
     try:
         print(f"Processing BDA request: {json.dumps(event)}")
         
-        # Handle SQS batch
-        for record in event.get('Records', []):
-            try:
-                message_body = json.loads(record['body'])
-                process_bda_job(message_body)
-            except Exception as e:
-                print(f"Error processing record: {e}")
-                traceback.print_exc()
-                # Continue with other records
-                
-        return {'statusCode': 200}
+        # Handle SQS batch; records are almost entirely waiting on S3 and BDA, so
+        # they run concurrently and the batch takes about as long as its slowest file
+        records = event.get('Records', [])
+        results = []
+        # (bucket, key) of staging and BDA output objects, deleted together at the end
+        cleanup = []
+        
+        if records:
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_RECORDS, len(records))) as executor:
+                results = list(executor.map(lambda record: process_record(record, context, cleanup), records))
+        
+        failed_message_ids = [record['messageId'] for record, (ok, _, _) in zip(records, results) if not ok]
+        
+        # Files finished in this batch are counted with one update per sync session
+        update_session_file_counts([(message, file_status) for _, message, file_status in results if file_status])
+        
+        delete_s3_objects(cleanup)
+        
+        # Only records that could not be handled at all are reported; file failures are
+        # already counted on the sync session and must not be retried
+        return {
+            'statusCode': 200,
+            'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+        }
         
     except Exception as e:
         print(f"Error in BDA processor: {e}")
         traceback.print_exc()
         return {'statusCode': 500, 'error': str(e)}
 
-def process_bda_job(message: Dict[str, Any]):
-    """Process a single BDA job"""
+def process_record(record: Dict[str, Any], context, cleanup: List[Tuple[str, str]]) -> Tuple[bool, Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Process one SQS record
+    
+    Returns whether the record was handled (False if it should be retried), its
+    message, and the file status to count on the sync session, if any.
+    """
+    try:
+        message_body = json.loads(record['body'])
+        return True, message_body, process_bda_job(message_body, context, cleanup)
+    except Exception as e:
+        print(f"Error processing record: {e}")
+        traceback.print_exc()
+        # Continue with other records
+        return False, None, None
+
+def process_bda_job(message: Dict[str, Any], context=None, cleanup: Optional[List[Tuple[str, str]]] = None) -> Optional[str]:
+    """
+    Process a single BDA job
+    
+    Messages with resumeFrom == 'poll' continue waiting for a BDA job started by an
+    earlier invocation that ran out of time. Returns the file status for the sync
+    session counters, or None while the job is still pending. Objects to delete are
+    added to cleanup when given, otherwise deleted right away.
+    """
     try:
         session_id = message.get('sessionId', '')
         file_location = message['fileLocation']
@@ -60,6 +166,7 @@ def process_bda_job(message: Dict[str, Any]):
         kb_id = message['knowledgeBaseId']
         data_source_id = message.get('dataSourceId', '')
         message_id = message.get('messageId', '')
+        resuming = message.get('resumeFrom') == 'poll'
         
         print(f"Processing BDA job for file: {file_location} (session: {session_id})")
         
@@ -68,44 +175,61 @@ def process_bda_job(message: Dict[str, Any]):
         source_bucket = parts[0]
         source_key = parts[1]
         
-        # Check if file needs processing based on file type
-        file_ext = get_file_extension(source_key)
-        should_process = False
-        
-        if file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp']:
-            should_process = True
-        elif file_ext == '.pdf':
-            should_process = is_scanned_pdf(s3, source_bucket, source_key)
-        
-        if not should_process:
-            print(f"File {source_key} doesn't need BDA processing (file type)")
-            update_session_file_status(session_id, kb_id, data_source_id, 'SKIPPED')
-            return
+        # A resumed job was checked and started by an earlier invocation
+        if not resuming:
+            # Check if file needs processing based on file type
+            file_ext = get_file_extension(source_key)
+            should_process = file_ext in BDA_IMAGE_EXTENSIONS or (
+                file_ext == 'pdf' and is_scanned_pdf(s3, source_bucket, source_key))
             
-        # Check if file has already been processed
-        if is_file_already_processed(s3, source_bucket, source_key):
-            print(f"File {source_key} has already been processed, skipping BDA processing")
-            update_session_file_status(session_id, kb_id, data_source_id, 'SKIPPED')
-            return
-            
-        # Update session status to BDA_PROCESSING when first file starts
-        update_session_to_bda_processing(session_id)
+            if not should_process:
+                print(f"File {source_key} doesn't need BDA processing (file type)")
+                return 'SKIPPED'
+                
+            # Check if file has already been processed; the listing also gives its size
+            already_processed, file_size = is_file_already_processed(s3, source_bucket, source_key)
+            if already_processed:
+                print(f"File {source_key} has already been processed, skipping BDA processing")
+                return 'SKIPPED'
+                
+            # Update session status to BDA_PROCESSING when first file starts
+            update_session_to_bda_processing(session_id)
+        
+        # Deferring a wait needs the job queue; without it the wait stays in this invocation
+        deadline_context = context if BDA_JOB_QUEUE_URL else None
         
         # Start BDA processing
-        result = process_with_bda_async(file_location, user_info)
+        result = process_with_bda_async(file_location, user_info, deadline_context,
+                                        resume=message if resuming else None, cleanup=cleanup,
+                                        file_size=None if resuming else file_size)
+        
+        if result['status'] == 'PENDING':
+            # Still running; the wait continues from a delayed copy of this message
+            defer_bda_job(message, result['resume'])
+            return None
         
         if result['status'] == 'SUCCESS':
             print(f"BDA processing completed for {source_key}")
-            update_session_file_status(session_id, kb_id, data_source_id, 'SUCCESS')
-        else:
-            print(f"BDA processing failed for {source_key}: {result.get('error')}")
-            update_session_file_status(session_id, kb_id, data_source_id, 'FAILED')
+            return 'SUCCESS'
+        
+        print(f"BDA processing failed for {source_key}: {result.get('error')}")
+        return 'FAILED'
             
     except Exception as e:
         print(f"Error in process_bda_job: {e}")
         traceback.print_exc()
-        if session_id and kb_id:
-            update_session_file_status(session_id, kb_id, data_source_id, 'ERROR')
+        return 'ERROR'
+
+def defer_bda_job(message: Dict[str, Any], resume: Dict[str, Any]):
+    """Re-enqueue a BDA job so a later invocation keeps waiting for it, instead of sleeping here"""
+    delay_seconds = resume.pop('delaySeconds')
+    sqs.send_message(
+        QueueUrl=BDA_JOB_QUEUE_URL,
+        MessageBody=json.dumps({**message, **resume, 'resumeFrom': 'poll'}),
+        # SQS caps message delays at 15 minutes
+        DelaySeconds=min(900, delay_seconds)
+    )
+    print(f"Deferred wait for BDA job {resume['invocationArn']} by {delay_seconds}s")
 
 def update_session_to_bda_processing(session_id: str):
     """Update session status from PREPARING to BDA_PROCESSING when first file starts"""
@@ -114,46 +238,72 @@ def update_session_to_bda_processing(session_id: str):
             print("No sync sessions table configured or no session ID")
             return
             
-        # Only update if status is currently PREPARING
-        sync_sessions_table.update_item(
-            Key={'sessionId': session_id},
+        # Only update if status is currently PREPARING. This runs on the record worker
+        # threads, so it uses the thread-safe low-level client rather than the Table resource
+        dynamodb.meta.client.update_item(
+            TableName=SYNC_SESSIONS_TABLE,
+            Key={'sessionId': {'S': session_id}},
             UpdateExpression="SET #status = :new_status, updatedAt = :timestamp",
             ConditionExpression="#status = :current_status",
             ExpressionAttributeNames={'#status': 'status'},
             ExpressionAttributeValues={
-                ':new_status': 'BDA_PROCESSING',
-                ':current_status': 'PREPARING',
-                ':timestamp': datetime.utcnow().isoformat()
+                ':new_status': {'S': 'BDA_PROCESSING'},
+                ':current_status': {'S': 'PREPARING'},
+                ':timestamp': {'S': datetime.utcnow().isoformat()}
             }
         )
         print(f"Updated session {session_id} status from PREPARING to BDA_PROCESSING")
         
-    except sync_sessions_table.exceptions.ConditionalCheckFailedException:
-        # Session is not in PREPARING state - this is fine, might already be updated
-        print(f"Session {session_id} is not in PREPARING state - skipping status update")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            # Session is not in PREPARING state - this is fine, might already be updated
+            print(f"Session {session_id} is not in PREPARING state - skipping status update")
+        else:
+            print(f"Error updating session to BDA_PROCESSING: {e}")
+            traceback.print_exc()
     except Exception as e:
         print(f"Error updating session to BDA_PROCESSING: {e}")
         traceback.print_exc()
 
-def update_session_file_status(session_id: str, kb_id: str, data_source_id: str, file_status: str):
-    """Update session with file completion status and check if all files are done"""
+def update_session_file_counts(outcomes: List[Tuple[Dict[str, Any], str]]):
+    """Add the file statuses from one batch to their sync sessions, one update per session"""
+    sessions = {}
+    for message, file_status in outcomes:
+        session_id = message.get('sessionId', '')
+        if not session_id:
+            continue
+        counts = sessions.setdefault(session_id, {
+            'kb_id': message.get('knowledgeBaseId', ''),
+            'data_source_id': message.get('dataSourceId', ''),
+            'completed': 0,
+            'failed': 0
+        })
+        if file_status in ['SUCCESS', 'SKIPPED']:
+            counts['completed'] += 1
+        else:
+            counts['failed'] += 1
+    
+    for session_id, counts in sessions.items():
+        update_session_file_status(session_id, counts['kb_id'], counts['data_source_id'],
+                                   counts['completed'], counts['failed'])
+
+def update_session_file_status(session_id: str, kb_id: str, data_source_id: str, completed: int, failed: int):
+    """Add completed and failed file counts to a session and check if all files are done"""
     try:
         if not SYNC_SESSIONS_TABLE or not session_id:
             print("No sync sessions table configured or no session ID")
             return
             
-        print(f"Updating session {session_id} with file status: {file_status}")
-        
-        # Update the session counters atomically
-        update_expression = "SET updatedAt = :timestamp"
-        expression_values = {':timestamp': datetime.utcnow().isoformat()}
-        
-        if file_status in ['SUCCESS', 'SKIPPED']:
-            update_expression += ", completedFiles = completedFiles + :inc"
-            expression_values[':inc'] = 1
-        elif file_status in ['FAILED', 'ERROR']:
-            update_expression += ", failedFiles = failedFiles + :inc"
-            expression_values[':inc'] = 1
+        print(f"Updating session {session_id}: {completed} completed, {failed} failed")
+        
+        # Update both session counters atomically in a single write
+        update_expression = ("SET updatedAt = :timestamp, completedFiles = completedFiles + :completed, "
+                             "failedFiles = failedFiles + :failed")
+        expression_values = {
+            ':timestamp': datetime.utcnow().isoformat(),
+            ':completed': completed,
+            ':failed': failed
+        }
         
         # Update the session
         response = sync_sessions_table.update_item(
@@ -171,15 +321,34 @@ def update_session_file_status(session_id: str, kb_id: str, data_source_id: str,
         
         print(f"Session {session_id}: {processed_files}/{total_files} files processed")
         
-        # Check if all files are processed
+        # Check if all files are processed; only the worker that claims the session
+        # starts ingestion, even if redelivered messages push the count past the total
         if processed_files >= total_files and total_files > 0:
-            print(f"All files processed for session {session_id}. Starting ingestion job.")
-            start_ingestion_for_session(session_id, kb_id, data_source_id)
+            if claim_ingestion_start(session_id):
+                print(f"All files processed for session {session_id}. Starting ingestion job.")
+                start_ingestion_for_session(session_id, kb_id, data_source_id)
+            else:
+                print(f"Ingestion for session {session_id} already claimed by another worker")
         
     except Exception as e:
         print(f"Error updating session file status: {e}")
         traceback.print_exc()
 
+def claim_ingestion_start(session_id: str) -> bool:
+    """Atomically mark a session's ingestion as claimed; returns False if it already was"""
+    try:
+        sync_sessions_table.update_item(
+            Key={'sessionId': session_id},
+            UpdateExpression="SET ingestionClaimedAt = :timestamp",
+            ConditionExpression="attribute_not_exists(ingestionClaimedAt) AND attribute_not_exists(ingestionJobId)",
+            ExpressionAttributeValues={':timestamp': datetime.utcnow().isoformat()}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
 def start_ingestion_for_session(session_id: str, kb_id: str, data_source_id: str):
     """Start ingestion job when all BDA processing is complete"""
     try:
@@ -230,10 +399,16 @@ def start_ingestion_for_session(session_id: str, kb_id: str, data_source_id: str
         except Exception as update_error:
             print(f"Error updating session with failure status: {update_error}")
 
-def process_with_bda_async(s3_location: str, user_info: Dict[str, Any]) -> Dict[str, Any]:
+def process_with_bda_async(s3_location: str, user_info: Dict[str, Any], context=None, resume: Optional[Dict[str, Any]] = None,
+                           cleanup: Optional[List[Tuple[str, str]]] = None, file_size: Optional[int] = None) -> Dict[str, Any]:
     """
     Process file with BDA asynchronously
-    Returns immediately after starting the job, doesn't wait
+    
+    With a Lambda context, the wait for the job stops before the invocation runs out of
+    time and a PENDING result carries the state needed to resume it. A resume dict
+    (from a deferred message) skips staging and starting the job. Staging and BDA
+    output objects are added to cleanup when given, otherwise deleted before returning.
+    A known file_size lets small files stage with a single CopyObject.
     """
     try:
         # Parse S3 location
@@ -241,116 +416,34 @@ def process_with_bda_async(s3_location: str, user_info: Dict[str, Any]) -> Dict[
         source_bucket = parts[0]
         source_key = parts[1]
         
-        print(f"Starting BDA processing for s3://{source_bucket}/{source_key}")
-        
-        # Stage file to BDA bucket (us-east-1)
-        staging_key = f"staging/{user_info['identityId']}/{os.path.basename(source_key)}"
+        if resume:
+            job_id = resume['jobId']
+            staging_key = resume['stagingKey']
+            invocation_arn = resume['invocationArn']
+            print(f"Resuming wait for BDA job {invocation_arn}")
+        else:
+            job_id, staging_key, invocation_arn = start_bda_job(source_bucket, source_key, user_info, file_size)
         
-        # Copy to BDA bucket
-        s3.copy_object(
-            CopySource={'Bucket': source_bucket, 'Key': source_key},
-            Bucket=BDA_BUCKET,
-            Key=staging_key
+        # Wait for completion (with timeout)
+        completion_result = wait_for_bda_completion(
+            invocation_arn,
+            context=context,
+            first_attempt=resume.get('pollAttempt', 0) if resume else 0
         )
         
-        staging_location = f"s3://{BDA_BUCKET}/{staging_key}"
-        print(f"File staged to: {staging_location}")
-        
-        # Get account ID for the profile ARN
-        sts_client = boto3.client('sts')
-        account_id = sts_client.get_caller_identity()['Account']
-        
-        # Initialize BDA client for project management
-        bda_client = boto3.client('bedrock-data-automation', region_name='us-east-1')
-        
-        # Setup BDA project with standard output config for images
-        standard_output_config = {
-            "image": {
-                "extraction": {
-                    "category": {
-                        "state": "ENABLED",
-                        "types": ["CONTENT_MODERATION", "TEXT_DETECTION"]
-                    },
-                    "boundingBox": {"state": "ENABLED"}
-                },
-                "generativeField": {
-                    "state": "ENABLED",
-                    "types": ["IMAGE_SUMMARY", "IAB"]
-                }
-            }
-        }
-        
-        # Create or get BDA project
-        project_name = "image_processing_bda_project"
-        project_arn = None
-        
-        try:
-            # Check if project already exists
-            existing_projects = bda_client.list_data_automation_projects()
-            project_exists = False
-            
-            for project in existing_projects.get("projects", []):
-                if project["projectName"] == project_name:
-                    project_exists = True
-                    project_arn = project["projectArn"]
-                    print(f"Using existing BDA project: {project_arn}")
-                    break
-                    
-            if not project_exists:
-                print(f"Creating new BDA project: {project_name}")
-                response = bda_client.create_data_automation_project(
-                    projectName=project_name,
-                    projectDescription="Project for image processing with BDA",
-                    projectStage='LIVE',
-                    standardOutputConfiguration=standard_output_config
-                )
-                project_arn = response["projectArn"]
-                print(f"Created BDA project: {project_arn}")
-                
-        except Exception as project_error:
-            print(f"Error managing BDA project: {project_error}")
-            # If project creation fails, we'll skip BDA processing
-            return {
-                'status': 'FAILED',
-                'error': f'Unable to create or access BDA project: {str(project_error)}'
-            }
-        
-        # Prepare BDA request - only proceed if we have a project
-        if not project_arn:
+        if completion_result['status'] == 'Deferred':
             return {
-                'status': 'FAILED',
-                'error': 'No BDA project available for processing'
+                'status': 'PENDING',
+                'invocation_arn': invocation_arn,
+                'resume': {
+                    'jobId': job_id,
+                    'stagingKey': staging_key,
+                    'invocationArn': invocation_arn,
+                    'pollAttempt': completion_result['next_attempt'],
+                    'delaySeconds': completion_result['delay_seconds']
+                }
             }
         
-        output_prefix = f"processed/{user_info['identityId']}/{int(time.time())}/"
-        
-        request_payload = {
-            "inputConfiguration": {
-                "s3Uri": staging_location
-            },
-            "outputConfiguration": {
-                "s3Uri": f"s3://{BDA_BUCKET}/{output_prefix}"
-            },
-            "dataAutomationConfiguration": {
-                "dataAutomationProjectArn": project_arn,
-                "stage": "LIVE"
-            },
-            "dataAutomationProfileArn": f"arn:aws:bedrock:us-east-1:{account_id}:data-automation-profile/us.data-automation-v1"
-        }
-        
-        print(f"Invoking BDA with payload: {json.dumps(request_payload, default=str)}")
-        
-        # Start BDA job (async)
-        bda_response = bda_runtime_client.invoke_data_automation_async(
-            **request_payload
-        )        
-        
-        invocation_arn = bda_response['invocationArn']
-        print(f"BDA job started with ARN: {invocation_arn}")
-        
-        # Wait for completion (with timeout)
-        completion_result = wait_for_bda_completion(invocation_arn)
-        
         if completion_result['status'] != 'Success':
             return {
                 'status': 'FAILED',
@@ -359,10 +452,13 @@ def process_with_bda_async(s3_location: str, user_info: Dict[str, Any]) -> Dict[
             }
         
         # Process successful result
-        output_location = process_bda_output(completion_result, source_bucket, source_key, user_info)
+        deletes = [] if cleanup is None else cleanup
+        output_location = process_bda_output(completion_result, source_bucket, source_key, user_info, deletes)
         
         # Cleanup staging file
-        cleanup_staging_file(BDA_BUCKET, staging_key)
+        deletes.append((BDA_BUCKET, staging_key))
+        if cleanup is None:
+            delete_s3_objects(deletes)
         
         return {
             'status': 'SUCCESS',
@@ -378,9 +474,121 @@ def process_with_bda_async(s3_location: str, user_info: Dict[str, Any]) -> Dict[
             'error': str(e)
         }
 
-def wait_for_bda_completion(invocation_arn: str, max_attempts: int = 60, delay_seconds: int = 5) -> Dict[str, Any]:
-    """Wait for BDA job completion with extended timeout for async processing"""
-    for attempt in range(max_attempts):
+def start_bda_job(source_bucket: str, source_key: str, user_info: Dict[str, Any], file_size: Optional[int] = None) -> tuple:
+    """Stage a file in the BDA bucket and start a BDA job; returns (job_id, staging_key, invocation_arn)"""
+    print(f"Starting BDA processing for s3://{source_bucket}/{source_key}")
+    
+    # Stage file to BDA bucket (us-east-1); the job ID keeps files with the same
+    # name apart when several records run at once
+    job_id = str(uuid.uuid4())
+    staging_key = f"staging/{user_info['identityId']}/{job_id}/{os.path.basename(source_key)}"
+    
+    # Copy to BDA bucket: a single CopyObject below the multipart threshold, otherwise a
+    # managed copy (which looks the size up itself when it isn't known)
+    if file_size is not None and file_size < COPY_TRANSFER_CONFIG.multipart_threshold:
+        s3.copy_object(
+            CopySource={'Bucket': source_bucket, 'Key': source_key},
+            Bucket=BDA_BUCKET,
+            Key=staging_key
+        )
+    else:
+        s3.copy(
+            {'Bucket': source_bucket, 'Key': source_key},
+            BDA_BUCKET,
+            staging_key,
+            Config=COPY_TRANSFER_CONFIG
+        )
+    
+    staging_location = f"s3://{BDA_BUCKET}/{staging_key}"
+    print(f"File staged to: {staging_location}")
+    
+    # Create or get BDA project (cached after the first lookup)
+    try:
+        project_arn = get_bda_project_arn()
+    except Exception as project_error:
+        print(f"Error managing BDA project: {project_error}")
+        # If project creation fails, we'll skip BDA processing
+        raise Exception(f'Unable to create or access BDA project: {str(project_error)}')
+    
+    output_prefix = f"processed/{user_info['identityId']}/{int(time.time())}/{job_id}/"
+    
+    request_payload = {
+        "inputConfiguration": {
+            "s3Uri": staging_location
+        },
+        "outputConfiguration": {
+            "s3Uri": f"s3://{BDA_BUCKET}/{output_prefix}"
+        },
+        "dataAutomationConfiguration": {
+            "dataAutomationProjectArn": project_arn,
+            "stage": "LIVE"
+        },
+        "dataAutomationProfileArn": f"arn:aws:bedrock:us-east-1:{get_account_id()}:data-automation-profile/us.data-automation-v1"
+    }
+    
+    print(f"Invoking BDA with payload: {json.dumps(request_payload, default=str)}")
+    
+    # Start BDA job (async)
+    bda_response = bda_runtime_client.invoke_data_automation_async(
+        **request_payload
+    )        
+    
+    invocation_arn = bda_response['invocationArn']
+    print(f"BDA job started with ARN: {invocation_arn}")
+    
+    return job_id, staging_key, invocation_arn
+
+def get_account_id() -> str:
+    """Get the AWS account ID, calling STS only on the first use in this container"""
+    global account_id
+    if account_id is None:
+        account_id = sts_client.get_caller_identity()['Account']
+    return account_id
+
+def get_bda_project_arn() -> str:
+    """
+    Get the ARN of the BDA project, creating the project if it doesn't exist yet
+    
+    A project ARN configured through BDA_PROJECT_ARN is used as is, without any
+    list or create calls.
+    """
+    global bda_project_arn
+    if bda_project_arn is not None:
+        return bda_project_arn
+    
+    with bda_project_lock:
+        # Another record may have resolved it while this one waited
+        if bda_project_arn is None:
+            bda_project_arn = find_or_create_bda_project()
+    return bda_project_arn
+
+def find_or_create_bda_project() -> str:
+    """Find the BDA project by name, creating it if it doesn't exist"""
+    # Check if project already exists
+    existing_projects = bda_client.list_data_automation_projects()
+    for project in existing_projects.get("projects", []):
+        if project["projectName"] == BDA_PROJECT_NAME:
+            print(f"Using existing BDA project: {project['projectArn']}")
+            return project["projectArn"]
+    
+    print(f"Creating new BDA project: {BDA_PROJECT_NAME}")
+    response = bda_client.create_data_automation_project(
+        projectName=BDA_PROJECT_NAME,
+        projectDescription="Project for image processing with BDA",
+        projectStage='LIVE',
+        standardOutputConfiguration=BDA_STANDARD_OUTPUT_CONFIG
+    )
+    print(f"Created BDA project: {response['projectArn']}")
+    return response["projectArn"]
+
+def wait_for_bda_completion(invocation_arn: str, max_attempts: int = 60, delay_seconds: int = 5, context=None, first_attempt: int = 0) -> Dict[str, Any]:
+    """
+    Wait for BDA job completion with extended timeout for async processing
+    
+    With a Lambda context, returns status 'Deferred' (with the attempt to resume from
+    and the delay to wait first) instead of sleeping past the invocation's deadline.
+    """
+    for attempt in range(first_attempt, max_attempts):
         try:
             response = bda_runtime_client.get_data_automation_status(invocationArn=invocation_arn)
             status = response.get('status')
@@ -398,6 +606,15 @@ def wait_for_bda_completion(invocation_arn: str, max_attempts: int = 60, delay_s
                 # Use exponential backoff instead of fixed sleep
                 import random
                 backoff_delay = min(delay_seconds * (2 ** min(attempt, 4)), 30) + random.uniform(0, 1)
+                
+                # Hand the wait over to SQS rather than sleeping into the timeout
+                if context is not None and context.get_remaining_time_in_millis() - backoff_delay * 1000 < POLL_DEADLINE_MARGIN_MS:
+                    return {
+                        'status': 'Deferred',
+                        'next_attempt': attempt + 1,
+                        'delay_seconds': int(backoff_delay) + 1
+                    }
+                
                 # Legitimate exponential backoff delay for BDA job polling
                 time.sleep(backoff_delay)  # nosemgrep: arbitrary-sleep
             else:
@@ -422,8 +639,9 @@ def wait_for_bda_completion(invocation_arn: str, max_attempts: int = 60, delay_s
         'error_message': f'Job did not complete within {max_attempts * delay_seconds} seconds'
     }
 
-def process_bda_output(completion_result: Dict[str, Any], source_bucket: str, source_key: str, user_info: Dict[str, Any]) -> str:
-    """Process BDA output and copy back to original location"""
+def process_bda_output(completion_result: Dict[str, Any], source_bucket: str, source_key: str, user_info: Dict[str, Any],
+                       cleanup: List[Tuple[str, str]]) -> str:
+    """Process BDA output and copy back to original location, queueing the BDA files for cleanup"""
     try:
         # Get the job metadata S3 location
         job_metadata_s3_location = completion_result['outputConfiguration']['s3Uri']
@@ -490,12 +708,8 @@ def process_bda_output(completion_result: Dict[str, Any], source_bucket: str, so
         print(f"BDA output copied to: {dest_location}")
         
         # Cleanup BDA output files
-        try:
-            s3.delete_object(Bucket=output_bucket, Key=output_key)
-            s3.delete_object(Bucket=metadata_bucket, Key=metadata_key)
-            print(f"Cleaned up BDA output files")
-        except Exception as cleanup_error:
-            print(f"Warning: Failed to cleanup BDA output files: {cleanup_error}")
+        cleanup.append((output_bucket, output_key))
+        cleanup.append((metadata_bucket, metadata_key))
         
         return dest_location
         
@@ -503,26 +717,34 @@ def process_bda_output(completion_result: Dict[str, Any], source_bucket: str, so
         print(f"Error processing BDA output: {e}")
         raise e
 
-def cleanup_staging_file(bucket: str, key: str):
-    """Clean up staging file"""
-    try:
-        s3.delete_object(Bucket=bucket, Key=key)
-        print(f"Cleaned up staging file: s3://{bucket}/{key}")
-    except Exception as e:
-        print(f"Error cleaning up staging file: {e}")
+def delete_s3_objects(locations: List[Tuple[str, str]]):
+    """Delete (bucket, key) objects with one DeleteObjects request per bucket"""
+    keys_by_bucket = {}
+    for bucket, key in locations:
+        keys_by_bucket.setdefault(bucket, []).append(key)
+    
+    for bucket, keys in keys_by_bucket.items():
+        # DeleteObjects accepts at most 1000 keys per request
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            try:
+                response = s3.delete_objects(
+                    Bucket=bucket,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+                for error in response.get('Errors', []):
+                    print(f"Error cleaning up s3://{bucket}/{error['Key']}: {error.get('Message')}")
+                print(f"Cleaned up {len(batch)} objects in {bucket}")
+            except Exception as e:
+                print(f"Error cleaning up objects in {bucket}: {e}")
 
 def cleanup_bda_outputs(output_docs: list):
     """Clean up BDA output files"""
+    locations = []
     for doc in output_docs:
-        try:
-            output_location = doc['s3Location']
-            parts = output_location.replace('s3://', '').split('/', 1)
-            bucket = parts[0]
-            key = parts[1]
-            s3.delete_object(Bucket=bucket, Key=key)
-            print(f"Cleaned up BDA output: {output_location}")
-        except Exception as e:
-            print(f"Error cleaning up BDA output {doc.get('s3Location', 'unknown')}: {e}")
+        parts = doc['s3Location'].replace('s3://', '').split('/', 1)
+        locations.append((parts[0], parts[1]))
+    delete_s3_objects(locations)
 
 def send_completion_message(kb_id: str, file_location: str, status: str, user_info: Dict[str, Any], message_id: str, result: Dict[str, Any] = None):
     """Send completion message to results queue"""
@@ -551,15 +773,16 @@ def send_completion_message(kb_id: str, file_location: str, status: str, user_in
     except Exception as e:
         print(f"Error sending completion message: {e}")
 
-def is_file_already_processed(s3_client, bucket: str, key: str) -> bool:
+def is_file_already_processed(s3_client, bucket: str, key: str) -> Tuple[bool, Optional[int]]:
     """
     Check if file has already been processed by BDA
     
-    Returns True if:
+    Returns (processed, size), where size is the original file's size in bytes when
+    the listing found it, else None. processed is True if:
     - A processed file exists (.processed.json suffix)
     - The processed file is up-to-date (not older than original file)
     
-    Returns False if:
+    processed is False if:
     - No processed file exists
     - Original file is newer than processed file
     - Any error occurs during checking (safer to reprocess)
@@ -575,39 +798,41 @@ def is_file_already_processed(s3_client, bucket: str, key: str) -> bool:
         processed_key = f"{original_filename}.processed.json"
     
     try:
-        # Check if the processed file exists
-        processed_response = s3_client.head_object(Bucket=bucket, Key=processed_key)
-        processed_modified = processed_response['LastModified']
-        
-        # Also check the original file's modification time
-        original_response = s3_client.head_object(Bucket=bucket, Key=key)
-        original_modified = original_response['LastModified']
+        # The processed key is the original key plus a suffix, so listing with the
+        # original key as prefix returns both objects in a single request
+        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=key, MaxKeys=1000)
+        objects = {obj['Key']: obj for obj in response.get('Contents', [])}
+        original = objects.get(key)
+        size = original['Size'] if original else None
+        
+        processed = objects.get(processed_key)
+        if processed is None:
+            # File doesn't exist, not processed yet
+            print(f"Processed file not found: {processed_key} (file needs processing)")
+            return False, size
         
         # If original file is newer than processed file, we need to reprocess
-        if original_modified > processed_modified:
+        if original is None or original['LastModified'] > processed['LastModified']:
             print(f"Original file {key} is newer than processed file {processed_key} - reprocessing needed")
-            return False
+            return False, size
         
         print(f"Found existing processed file: {processed_key} (up to date)")
-        return True
+        return True, size
         
     except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            # File doesn't exist, not processed yet
-            print(f"Processed file not found: {processed_key} (file needs processing)")
-            return False
-        else:
-            # Some other error occurred (permissions, etc.)
-            print(f"Error checking if file is processed: {e}")
-            # Default to not processed if we can't determine (safer to reprocess than skip)
-            return False
+        # Some error occurred (permissions, etc.)
+        print(f"Error checking if file is processed: {e}")
+        # Default to not processed if we can't determine (safer to reprocess than skip)
+        return False, None
     except Exception as e:
         print(f"Unexpected error checking processed file: {e}")
-        return False
+        return False, None
 
 def get_file_extension(file_path: str) -> str:
-    """Get file extension from path"""
-    return os.path.splitext(file_path)[1].lower()
+    """Get the lowercase file extension from a key, without the dot"""
+    name = file_path.rpartition('/')[2]
+    base, dot, ext = name.rpartition('.')
+    return ext.lower() if dot and base else ''
 
 def is_scanned_pdf(s3_client, bucket: str, key: str) -> bool:
     """Check if PDF is scanned (simplified check)"""
@@ -617,8 +842,7 @@ def is_scanned_pdf(s3_client, bucket: str, key: str) -> bool:
         content = response['Body'].read()
         
         # Simple heuristic: if PDF contains minimal text content, likely scanned
-        text_indicators = [b'/Font', b'/Text', b'BT', b'ET']
-        text_count = sum(1 for indicator in text_indicators if indicator in content)
+        text_count = len(set(PDF_TEXT_MARKER_PATTERN.findall(content)))
         
         # If very few text indicators, likely scanned
         return text_count < 2
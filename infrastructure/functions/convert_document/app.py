@@ -2,10 +2,22 @@ import json
 import base64
 import tempfile
 import os
-import PyPDF2
+import boto3
+import pypdfium2 as pdfium
 from docx import Document
 import traceback
 
+ATTACHMENTS_BUCKET = os.environ.get('ATTACHMENTS_BUCKET', '')
+USER_POOL_ID = os.environ.get('USER_POOL_ID', '')
+IDENTITY_POOL_ID = os.environ.get('IDENTITY_POOL_ID', '')
+
+# Cognito identity IDs keyed by user sub; the mapping is fixed for an identity pool
+IDENTITY_ID_CACHE_MAX_SIZE = 4096
+identity_id_cache = {}
+
+s3 = boto3.client('s3', config=boto3.session.Config(signature_version='s3v4'))
+cognito_identity = boto3.client('cognito-identity')
+
 def create_response(status_code, body):
     return {
         "statusCode": status_code,
@@ -17,24 +29,62 @@ def create_response(status_code, body):
         }
     }
 
+def get_identity_id_from_token(jwt_token, sub=None):
+    """Get Cognito Identity ID from JWT token, cached per sub"""
+    if sub and sub in identity_id_cache:
+        return identity_id_cache[sub]
+    
+    region = os.environ['AWS_REGION']
+    response = cognito_identity.get_id(
+        IdentityPoolId=IDENTITY_POOL_ID,
+        Logins={
+            f'cognito-idp.{region}.amazonaws.com/{USER_POOL_ID}': jwt_token
+        }
+    )
+    identity_id = response['IdentityId']
+    
+    if sub:
+        # Evict the oldest entry when full (dicts keep insertion order)
+        if len(identity_id_cache) >= IDENTITY_ID_CACHE_MAX_SIZE:
+            identity_id_cache.pop(next(iter(identity_id_cache)), None)
+        identity_id_cache[sub] = identity_id
+    
+    return identity_id
+
+def is_own_attachment_key(event, key):
+    """Check that an attachments bucket key lies under the caller's identity prefix"""
+    headers = event.get('headers') or {}
+    auth_header = headers.get('Authorization') or headers.get('authorization') or ''
+    if not auth_header.startswith('Bearer '):
+        return False
+    
+    sub = (event.get('requestContext', {}).get('authorizer') or {}).get('sub')
+    identity_id = get_identity_id_from_token(auth_header[7:], sub)
+    return key.startswith(f"users/{identity_id}/") or key.startswith(f"{identity_id}/")
+
+def read_attachment(key):
+    """Read an uploaded file from the attachments bucket"""
+    obj = s3.get_object(Bucket=ATTACHMENTS_BUCKET, Key=key)
+    return obj['Body'].read()
+
 def extract_text_from_pdf(file_content):
     """Extract text from a PDF file content"""
-    text = ""
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-        temp_file.write(file_content)
-        temp_file.flush()
-        
-        try:
-            reader = PyPDF2.PdfReader(temp_file.name)
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        finally:
-            # Clean up temp file
-            os.unlink(temp_file.name)
-    
-    return text
+    pdf = pdfium.PdfDocument(file_content)
+    try:
+        parts = []
+        for page in pdf:
+            try:
+                textpage = page.get_textpage()
+                try:
+                    # PDFium ends lines with \r\n; keep the \n line endings PyPDF2 produced
+                    parts.append(textpage.get_text_bounded().replace("\r\n", "\n"))
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+    return "\n".join(part for part in parts if part)
 
 def extract_text_from_docx(file_content):
     """Extract text from a Word document content"""
@@ -60,27 +110,49 @@ def lambda_handler(event, context):
         body = json.loads(event['body'])
         file_type = body.get('fileType', '').lower()
         file_content_base64 = body.get('fileContent')
+        key = body.get('key')
         
-        if not file_type or not file_content_base64:
+        if not file_type or not (file_content_base64 or key):
             return create_response(400, {
                 "success": False,
                 "error": {
                     "code": "MISSING_PARAMETER",
-                    "message": "File content and file type are required"
+                    "message": "File type and either file content or an attachments key are required"
                 }
             })
         
-        # Decode base64 file content
-        try:
-            file_content = base64.b64decode(file_content_base64)
-        except Exception as e:
-            return create_response(400, {
-                "success": False,
-                "error": {
-                    "code": "INVALID_FILE_CONTENT",
-                    "message": "File content must be base64 encoded"
-                }
-            })
+        if key:
+            # Read an already uploaded file instead of a base64 copy in the request body
+            if not is_own_attachment_key(event, key):
+                return create_response(403, {
+                    "success": False,
+                    "error": {
+                        "code": "ACCESS_DENIED",
+                        "message": "The file key must be under your own upload prefix"
+                    }
+                })
+            try:
+                file_content = read_attachment(key)
+            except s3.exceptions.NoSuchKey:
+                return create_response(404, {
+                    "success": False,
+                    "error": {
+                        "code": "FILE_NOT_FOUND",
+                        "message": f"File not found: {key}"
+                    }
+                })
+        else:
+            # Decode base64 file content
+            try:
+                file_content = base64.b64decode(file_content_base64)
+            except Exception as e:
+                return create_response(400, {
+                    "success": False,
+                    "error": {
+                        "code": "INVALID_FILE_CONTENT",
+                        "message": "File content must be base64 encoded"
+                    }
+                })
         
         # Process the document based on file type
         if file_type in ['pdf']:
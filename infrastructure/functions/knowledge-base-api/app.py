@@ -27,6 +27,10 @@ ALLOWED_ORIGINS = os.environ.get('ALLOWED_ORIGINS', '*')
 USER_POOL_ID = os.environ.get('USER_POOL_ID', '')
 IDENTITY_POOL_ID = os.environ.get('IDENTITY_POOL_ID', '')
 
+# Cognito identity IDs keyed by user sub; the mapping is fixed for an identity pool
+IDENTITY_ID_CACHE_MAX_SIZE = 4096
+identity_id_cache = {}
+
 # Initialize clients
 dynamodb = boto3.resource('dynamodb')
 bedrock_agent = boto3.client('bedrock-agent', region_name=REGION_NAME)
@@ -76,8 +80,16 @@ def create_error_response(status_code: int, error_code: str, error_message: str)
         }
     })
 
-def get_identity_id_from_token(jwt_token: str) -> str:
-    """Get Cognito Identity ID from JWT token"""
+def get_identity_id_from_token(jwt_token: str, sub: Optional[str] = None) -> str:
+    """
+    Get Cognito Identity ID from JWT token
+    
+    The identity ID for a user never changes, so results are cached per sub
+    and later requests from the same user skip the GetId call.
+    """
+    if sub and sub in identity_id_cache:
+        return identity_id_cache[sub]
+    
     try:
         # Extract user pool ID and region from environment
         user_pool_id = USER_POOL_ID
@@ -90,11 +102,19 @@ def get_identity_id_from_token(jwt_token: str) -> str:
                 f'cognito-idp.{region}.amazonaws.com/{user_pool_id}': jwt_token
             }
         )
-        return response['IdentityId']
+        identity_id = response['IdentityId']
     except Exception as e:
         print(f"Error getting identity ID from token: {e}")
         traceback.print_exc()
         raise e
+    
+    if sub:
+        # Evict the oldest entry when full (dicts keep insertion order)
+        if len(identity_id_cache) >= IDENTITY_ID_CACHE_MAX_SIZE:
+            identity_id_cache.pop(next(iter(identity_id_cache)), None)
+        identity_id_cache[sub] = identity_id
+    
+    return identity_id
 
 def get_user_info(event) -> dict:
     """Extract user information from Cognito authorizer context"""
@@ -131,7 +151,7 @@ def get_user_info(event) -> dict:
     # Get the identity ID for S3 operations (but use sub for ownership checks)
     if jwt_token:
         try:
-            user_info['identityId'] = get_identity_id_from_token(jwt_token)
+            user_info['identityId'] = get_identity_id_from_token(jwt_token, user_info['sub'])
             print(f"Mapped token to identityId {user_info['identityId']}")
         except Exception as e:
             print(f"Failed to get identityId from token: {e}")
@@ -3,7 +3,8 @@
 // New interface for direct document conversion
 export interface DocumentConversionRequest {
   fileType: string;
-  fileContent: string; // base64 encoded file content
+  fileContent?: string; // base64 encoded file content
+  key?: string; // attachments bucket key of an already uploaded file, instead of fileContent
 }
 
 export interface DocumentConversionResponse {